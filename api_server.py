@@ -7,19 +7,27 @@ Run this on your Windows PC.
 
 Usage:
     uvicorn api_server:app --reload --host 0.0.0.0 --port 8000
+
+Install uvicorn[standard] to get the faster uvloop event loop and
+httptools HTTP parser; uvicorn picks them up on its own when present.
+Running this file directly also turns off the per-request access log.
 """
 
 import json
 import csv
+import asyncio
+import io
 import os
+import queue
+import itertools
+import operator
 import threading
 from datetime import datetime
-from collections import deque
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse
 
 try:
     import paho.mqtt.client as mqtt
@@ -27,6 +35,27 @@ except ImportError:
     print("Please install paho-mqtt: pip install paho-mqtt")
     exit(1)
 
+try:
+    import numpy as np
+except ImportError:
+    print("Please install numpy: pip install numpy")
+    exit(1)
+
+# The simulator sends MessagePack whenever msgpack is installed on the Pi
+try:
+    import msgpack
+except ImportError:
+    print("Please install msgpack: pip install msgpack")
+    exit(1)
+
+# orjson is optional; both accept bytes in and publish() accepts either output
+try:
+    import orjson
+    json_loads, json_dumps = orjson.loads, orjson.dumps
+except ImportError:
+    json_loads, json_dumps = json.loads, json.dumps
+
+
 # CSV file for persistent logging
 CSV_FILE = "sensor_readings.csv"
 CSV_COLUMNS = [
@@ -34,26 +63,124 @@ CSV_COLUMNS = [
     "dissolved_oxygen_mgL", "ec_uScm", "water_level_percent",
     "humidity_percent", "light_lux", "pump_status", "diagnosis"
 ]
+_row_getter = operator.itemgetter(*CSV_COLUMNS)
+_ROW_FORMAT = ",".join(["%s"] * len(CSV_COLUMNS)) + "\r\n"
+
+CSV_BATCH_SIZE = 64      # max rows written per flush
+CSV_FSYNC_EVERY = 16     # fsync once every N flushed batches
+CSV_QUEUE_SIZE = 10_000  # readings buffered before new ones are dropped
+
+# Rows are queued by the MQTT thread and written by a background worker
+_csv_queue = queue.Queue(maxsize=CSV_QUEUE_SIZE)
+csv_dropped = 0  # readings not logged because the queue was full
+_csv_fd = None
+_csv_buf = bytearray()
+_csv_thread = None
 
 
 def init_csv():
-    """Initialize CSV file with headers if it doesn't exist."""
-    if not os.path.exists(CSV_FILE):
-        with open(CSV_FILE, 'w', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
-            writer.writeheader()
+    """Initialize CSV file with headers if it doesn't exist and open it for appending."""
+    global _csv_fd
+    is_new = not os.path.exists(CSV_FILE)
+    flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0)
+    _csv_fd = os.open(CSV_FILE, flags, 0o644)
+    if is_new:
+        os.write(_csv_fd, format_csv_row(CSV_COLUMNS).encode("utf-8"))
         print(f"📄 Created {CSV_FILE}")
 
 
+def format_csv_row(values):
+    """Format one CSV line; rows that need quoting or hold None go through the csv module."""
+    values = tuple(values)
+    line = _ROW_FORMAT % values
+    body = line[:-2]  # without the \r\n terminator
+    if (None in values or body.count(",") != len(CSV_COLUMNS) - 1
+            or '"' in body or "\r" in body or "\n" in body):
+        out = io.StringIO()
+        csv.writer(out).writerow(values)
+        line = out.getvalue()
+    return line
+
+
 def log_to_csv(reading):
-    """Append a sensor reading to the CSV file."""
+    """Queue a sensor reading for the CSV writer thread (never blocks).
+
+    The reading must already contain every CSV column (see on_all_message);
+    missing ones are None and are written as empty fields.
+    If the writer has fallen behind and the queue is full, the reading is
+    dropped and counted in csv_dropped.
+    """
+    global csv_dropped
     try:
-        with open(CSV_FILE, 'a', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
-            row = {col: reading.get(col, '') for col in CSV_COLUMNS}
-            writer.writerow(row)
-    except Exception as e:
-        print(f"⚠️ CSV write error: {e}")
+        _csv_queue.put_nowait(reading)
+    except queue.Full:
+        csv_dropped += 1
+
+
+def _write_all(fd, data):
+    """os.write() the whole buffer; a single call may write only part of it."""
+    with memoryview(data) as view:
+        written = 0
+        while written < len(view):
+            with view[written:] as rest:
+                n = os.write(fd, rest)
+            if n == 0:
+                raise OSError(f"wrote 0 of {len(view) - written} remaining bytes")
+            written += n
+
+
+def _csv_worker():
+    """Drain queued rows and append each batch with a single write() call."""
+    global _csv_buf
+    batches = 0
+    while True:
+        row = _csv_queue.get()
+        if row is None:
+            break
+        batch = [row]
+        stop = False
+        while len(batch) < CSV_BATCH_SIZE:
+            try:
+                row = _csv_queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is None:
+                stop = True
+                break
+            batch.append(row)
+        try:
+            for reading in batch:
+                _csv_buf += format_csv_row(_row_getter(reading)).encode("utf-8")
+            _write_all(_csv_fd, _csv_buf)
+            batches += 1
+            if batches % CSV_FSYNC_EVERY == 0:
+                os.fsync(_csv_fd)
+        except Exception as e:
+            print(f"⚠️ CSV write error, batch of {len(batch)} readings not fully written: {e}")
+        finally:
+            _csv_buf.clear()
+        if stop:
+            break
+
+
+def start_csv_writer():
+    global _csv_thread
+    _csv_thread = threading.Thread(target=_csv_worker, name="csv_writer", daemon=True)
+    _csv_thread.start()
+
+
+def stop_csv_writer():
+    global _csv_fd, _csv_thread
+    if _csv_thread:
+        try:
+            _csv_queue.put(None, timeout=5)  # sentinel: flush what's left and exit
+        except queue.Full:
+            print("⚠️ CSV writer still busy, unwritten readings will be lost")
+        _csv_thread.join(timeout=5)
+        _csv_thread = None
+    if _csv_fd is not None:
+        os.close(_csv_fd)
+        _csv_fd = None
 
 
 # -----------------------------
@@ -61,12 +188,203 @@ def log_to_csv(reading):
 # -----------------------------
 MQTT_BROKER = "localhost"
 MQTT_PORT = 1883
+SENSOR_TOPIC = "aquaponics/sensors/all"
 MAX_READINGS = 500
 
-# Thread-safe storage
-sensor_readings = deque(maxlen=MAX_READINGS)
+# Ring buffer of recent readings: one writer (MQTT thread), many readers.
+# Readings are stored as rows of a typed NumPy array instead of dicts. The
+# writer publishes the index it is about to fill, fills the row and then
+# publishes it as the latest, so readers can copy the newest rows without
+# taking a lock.
+_HIST_DTYPE = np.dtype([
+    ("timestamp", "S32"),
+    ("water_temp_C", "f8"),
+    ("air_temp_C", "f8"),
+    ("pH", "f8"),
+    ("ammonia_mgL", "f8"),
+    ("dissolved_oxygen_mgL", "f8"),
+    ("ec_uScm", "f8"),
+    ("water_level_percent", "f8"),
+    ("humidity_percent", "f8"),
+    ("light_lux", "f8"),
+    ("pump_status", "S8"),
+    ("light_status", "S4"),
+    ("reading_id", "i8"),
+    ("diagnosis", "S32"),
+    # Bit k set: field k was missing / not of its column's type / a string
+    # that is not ASCII or too long for its column (served as null), or was
+    # an int stored in a float column (served as an int)
+    ("missing", "u2"),
+    ("ints", "u2"),
+])
+_HIST_FIELDS = _HIST_DTYPE.names[:-2]  # includes every CSV column
+_reading_keys = frozenset(_HIST_FIELDS)
+_HIST_KINDS = tuple(_HIST_DTYPE[name].kind for name in _HIST_FIELDS)
+_HIST_WIDTHS = tuple(_HIST_DTYPE[name].itemsize for name in _HIST_FIELDS)
+_HIST_STR_COLS = tuple(k for k, kind in enumerate(_HIST_KINDS) if kind == "S")
+_HIST_FILL = {"f": 0.0, "i": 0, "S": b""}
+_hist_getter = operator.itemgetter(*_HIST_FIELDS)
+# ints mask for every tuple of field types that can be stored as is
+_HIST_TYPES = {"f": (float, int), "i": (int,), "S": (str,)}
+_INTS_MASKS = {
+    types: sum(1 << k for k, (t, kind) in enumerate(zip(types, _HIST_KINDS))
+               if kind == "f" and t is int)
+    for types in itertools.product(*(_HIST_TYPES[kind] for kind in _HIST_KINDS))
+}
+_HIST_STR_WIDTHS = tuple((k, _HIST_WIDTHS[k]) for k in _HIST_STR_COLS)
+_hist = np.zeros(MAX_READINGS, dtype=_HIST_DTYPE)
+_widx = itertools.count()
+_writing_idx = -1  # row being (or last) written
+_latest_idx = -1   # newest complete row
+
+
+def _store_reading(i, reading):
+    """Write a reading into history row i % MAX_READINGS."""
+    # Fast path: every field present, of its column's type and fitting
+    values = _hist_getter(reading)
+    ints = _INTS_MASKS.get(tuple(map(type, values)))
+    if ints is not None:
+        for k, width in _HIST_STR_WIDTHS:
+            if len(values[k]) > width or not values[k].isascii():
+                break
+        else:
+            _hist[i % MAX_READINGS] = values + (0, ints)
+            return
+    row = []
+    missing = ints = 0
+    for k, (name, kind, width) in enumerate(zip(_HIST_FIELDS, _HIST_KINDS, _HIST_WIDTHS)):
+        value = reading.get(name)
+        value_type = type(value)
+        if kind == "f" and value_type is int:
+            ints |= 1 << k
+        elif not (kind == "f" and value_type is float
+                  or kind == "i" and value_type is int
+                  # numpy would silently cut longer strings short
+                  or kind == "S" and value_type is str
+                  and len(value) <= width and value.isascii()):
+            missing |= 1 << k
+            value = _HIST_FILL[kind]
+        row.append(value)
+    row.append(missing)
+    row.append(ints)
+    _hist[i % MAX_READINGS] = tuple(row)
+
+
+def _row_to_reading(row):
+    """Turn a history row back into a reading dict (missing fields are None)."""
+    *values, missing, ints = row
+    for k in _HIST_STR_COLS:
+        values[k] = values[k].decode("ascii")
+    if not (missing or ints):
+        return dict(zip(_HIST_FIELDS, values))
+    reading = {}
+    for k, (name, value) in enumerate(zip(_HIST_FIELDS, values)):
+        if missing >> k & 1:
+            value = None
+        elif ints >> k & 1:
+            value = int(value)
+        reading[name] = value
+    return reading
+
+
+def recent_readings(limit=MAX_READINGS):
+    """Return up to `limit` of the newest readings as dicts, oldest first."""
+    end = _latest_idx
+    available = min(end + 1, MAX_READINGS)
+    if limit <= 0 or limit > available:
+        limit = available
+    start = end - limit + 1
+    rows = _hist[np.arange(start, end + 1) % MAX_READINGS]
+    writing_after = _writing_idx
+    rows = rows.tolist()
+    # Row writes are not atomic. While we copied, the writer can only have
+    # filled indices end + 1 .. writing_after, whose slots hold our rows
+    # up to writing_after - MAX_READINGS; drop those. A quiet buffer keeps
+    # all of them.
+    stale = writing_after - MAX_READINGS - start + 1
+    if stale > 0:
+        rows = rows[stale:]
+    return [_row_to_reading(row) for row in rows]
+
+
+# Latest snapshots. on_all_message builds fresh dicts and rebinds these names
+# (atomic under the GIL) and never mutates them afterwards, so readers
+# just take a local reference.
 latest_reading = {}
-lock = threading.Lock()
+latest_alerts = {}  # /alerts response, built once per reading at ingest
+
+# Server-Sent Events: one asyncio.Queue per connected /events client,
+# fed from the MQTT thread through the server's event loop.
+SSE_QUEUE_SIZE = 16
+SSE_PING_INTERVAL = 15  # seconds between keep-alive comments on idle streams
+_event_loop = None
+_event_subscribers = set()
+_events_closed = False
+
+
+def _offer_event(q, event):
+    """Queue an event for one subscriber, dropping it if the client is behind."""
+    try:
+        q.put_nowait(event)
+    except asyncio.QueueFull:
+        pass
+
+
+def broadcast_reading(reading, alerts):
+    """Push a reading and its alerts to every /events subscriber (thread-safe)."""
+    if _event_loop is None or not _event_subscribers:
+        return
+    data = json_dumps({"latest": reading, "alerts": alerts})
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    event = b"data: " + data + b"\n\n"
+    for q in list(_event_subscribers):
+        _event_loop.call_soon_threadsafe(_offer_event, q, event)
+
+
+def _end_stream(q):
+    """Queue the end-of-stream marker, making room for it if needed."""
+    while True:
+        try:
+            q.put_nowait(None)
+            return
+        except asyncio.QueueFull:
+            q.get_nowait()
+
+
+def close_event_streams():
+    """End every open /events stream and refuse new ones (thread-safe)."""
+    global _events_closed
+    _events_closed = True
+    if _event_loop is None:
+        return
+    for q in list(_event_subscribers):
+        _event_loop.call_soon_threadsafe(_end_stream, q)
+
+
+def _hook_uvicorn_exit():
+    """Close /events streams as soon as uvicorn is asked to exit.
+
+    uvicorn waits for open responses to finish before it runs the lifespan
+    shutdown, so the endless event streams would block shutdown and
+    --reload. Ending them from uvicorn's exit handler is the same hook
+    sse-starlette uses.
+    """
+    try:
+        from uvicorn.server import Server
+    except ImportError:
+        return
+    handle_exit = Server.handle_exit
+
+    def _handle_exit(self, sig, frame):
+        close_event_streams()
+        return handle_exit(self, sig, frame)
+
+    Server.handle_exit = _handle_exit
+
+
+_hook_uvicorn_exit()
+
 
 # Thresholds for alerts
 THRESHOLDS = {
@@ -78,14 +396,8 @@ THRESHOLDS = {
 }
 
 
-def diagnose(reading):
-    """Rule-based diagnosis."""
-    low_do = reading.get("dissolved_oxygen_mgL", 10) < THRESHOLDS["do_low"]
-    high_ammonia = reading.get("ammonia_mgL", 0) > THRESHOLDS["ammonia_high"]
-    low_water_level = reading.get("water_level_percent", 100) < THRESHOLDS["water_level_low"]
-    high_temp = reading.get("water_temp_C", 20) > THRESHOLDS["temp_high"]
-    low_ph = reading.get("pH", 7) < THRESHOLDS["ph_low"]
-    
+def _diagnose_rules(low_water_level, low_do, high_ammonia, high_temp, low_ph):
+    """Rule-based diagnosis from the individual threshold checks."""
     if low_water_level and low_do:
         return "Pump failure suspected"
     elif high_ammonia and low_do:
@@ -100,6 +412,60 @@ def diagnose(reading):
         return "Normal operation"
 
 
+# Every combination of the five checks, packed as
+# low_water_level<<4 | low_do<<3 | high_ammonia<<2 | high_temp<<1 | low_ph
+_DIAG_TABLE = {
+    key: _diagnose_rules(*(bool(key >> bit & 1) for bit in (4, 3, 2, 1, 0)))
+    for key in range(32)
+}
+
+
+# (type, sensor, message format) for each threshold check, in the order
+# evaluate() produces its flags
+_ALERT_RULES = (
+    ("warning", "dissolved_oxygen", "Low DO: {} mg/L"),
+    ("danger", "ammonia", "High ammonia: {} mg/L"),
+    ("danger", "water_level", "Low water: {}%"),
+    ("warning", "temperature", "High temp: {}°C"),
+    ("warning", "pH", "Low pH: {}"),
+)
+
+
+def evaluate(reading):
+    """Run the threshold checks once and return (diagnosis, alerts)."""
+    get = reading.get
+    t = THRESHOLDS
+    values = (
+        get("dissolved_oxygen_mgL", 10),
+        get("ammonia_mgL", 0),
+        get("water_level_percent", 100),
+        get("water_temp_C", 20),
+        get("pH", 7),
+    )
+    do, nh3, level, temp, ph = values
+    flags = (
+        do < t["do_low"],
+        nh3 > t["ammonia_high"],
+        level < t["water_level_low"],
+        temp > t["temp_high"],
+        ph < t["ph_low"],
+    )
+    low_do, high_ammonia, low_water_level, high_temp, low_ph = flags
+
+    key = low_water_level << 4 | low_do << 3 | high_ammonia << 2 | high_temp << 1 | low_ph
+    diagnosis = _DIAG_TABLE[key]
+
+    alerts = [
+        {"type": kind, "sensor": sensor, "message": fmt.format(value)}
+        for (kind, sensor, fmt), flag, value in zip(_ALERT_RULES, flags, values)
+        if flag
+    ]
+    if get("pump_status") == "FAILURE":
+        alerts.append({"type": "danger", "sensor": "pump", "message": "Pump failure detected!"})
+
+    return diagnosis, alerts
+
+
 # -----------------------------
 # MQTT Client Setup
 # -----------------------------
@@ -109,23 +475,56 @@ mqtt_client = None
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
         print("✅ MQTT Connected!")
-        client.subscribe("aquaponics/sensors/#")
+        client.subscribe(SENSOR_TOPIC)
     else:
         print(f"❌ MQTT Connection failed: {rc}")
 
 
-def on_message(client, userdata, msg):
-    global latest_reading
+# MessagePack readings arrive as [version, *values] in this field order.
+# Keep in sync with READING_FIELDS in rpi_sensor_simulator.py.
+READING_FORMAT_VERSION = 1
+READING_FIELDS = (
+    "timestamp", "water_temp_C", "air_temp_C", "pH", "ammonia_mgL",
+    "dissolved_oxygen_mgL", "ec_uScm", "water_level_percent",
+    "humidity_percent", "light_lux", "pump_status", "light_status", "reading_id"
+)
+
+
+def decode_reading(data):
+    """Decode a combined reading sent as a JSON object or a MessagePack array."""
+    if data[:1] == b"{":
+        return json_loads(data)
+    values = msgpack.unpackb(data, raw=False)
+    if values[0] != READING_FORMAT_VERSION:
+        raise ValueError(f"unsupported reading format version: {values[0]}")
+    return dict(zip(READING_FIELDS, values[1:]))
+
+
+def on_all_message(client, userdata, msg):
+    """Handle a combined reading published on SENSOR_TOPIC."""
+    global latest_reading, latest_alerts, _writing_idx, _latest_idx
     try:
-        if msg.topic == "aquaponics/sensors/all":
-            payload = json.loads(msg.payload.decode())
-            payload["diagnosis"] = diagnose(payload)
-            with lock:
-                latest_reading = payload
-                sensor_readings.append(payload)
-            # Log to CSV for persistence
-            log_to_csv(payload)
-            print(f"📥 Received reading #{payload.get('reading_id', '?')}: {payload['diagnosis']}")
+        payload = decode_reading(msg.payload)
+        payload["diagnosis"], alerts = evaluate(payload)
+        alerts_response = {
+            "alerts": alerts,
+            "alert_count": len(alerts),
+            "diagnosis": payload["diagnosis"]
+        }
+        # Missing fields are None in /latest, /data and /events alike
+        if not _reading_keys <= payload.keys():
+            for name in _HIST_FIELDS:
+                payload.setdefault(name, None)
+        i = next(_widx)
+        _writing_idx = i
+        _store_reading(i, payload)
+        _latest_idx = i
+        latest_alerts = alerts_response
+        latest_reading = payload
+        broadcast_reading(payload, alerts_response)
+        # Log to CSV for persistence
+        log_to_csv(payload)
+        print(f"📥 Received reading #{payload.get('reading_id', '?')}: {payload['diagnosis']}")
     except Exception as e:
         print(f"Error: {e}")
 
@@ -134,7 +533,8 @@ def start_mqtt_client():
     global mqtt_client
     mqtt_client = mqtt.Client(client_id="fastapi_subscriber")
     mqtt_client.on_connect = on_connect
-    mqtt_client.on_message = on_message
+    mqtt_client.message_callback_add(SENSOR_TOPIC, on_all_message)
+    start_csv_writer()
     
     try:
         mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
@@ -151,6 +551,7 @@ def stop_mqtt_client():
         mqtt_client.loop_stop()
         mqtt_client.disconnect()
         print("🔌 MQTT client stopped")
+    stop_csv_writer()
 
 
 # -----------------------------
@@ -158,11 +559,15 @@ def stop_mqtt_client():
 # -----------------------------
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global _event_loop, _events_closed
     # Startup
+    _event_loop = asyncio.get_running_loop()
+    _events_closed = False
     init_csv()  # Initialize CSV file
     start_mqtt_client()
     yield
     # Shutdown
+    close_event_streams()
     stop_mqtt_client()
 
 
@@ -186,7 +591,7 @@ app.add_middleware(
 # API Endpoints
 # -----------------------------
 @app.get("/")
-def read_root():
+def read_root() -> dict:
     return {
         "message": "Welcome to Aquaponics IoT API v2.0",
         "endpoints": {
@@ -194,6 +599,7 @@ def read_root():
             "/data": "Get historical readings",
             "/status": "System status",
             "/alerts": "Current alerts",
+            "/events": "Live readings (Server-Sent Events)",
             "/dashboard": "Web dashboard",
             "/download-csv": "Download all recorded data as CSV"
         }
@@ -201,12 +607,12 @@ def read_root():
 
 
 @app.get("/latest")
-def get_latest():
+def get_latest() -> dict:
     """Get the most recent sensor reading."""
-    with lock:
-        if latest_reading:
-            return latest_reading
-        return {"message": "No data yet. Is the Raspberry Pi publishing?"}
+    snap = latest_reading
+    if snap:
+        return snap
+    return {"message": "No data yet. Is the Raspberry Pi publishing?"}
 
 
 @app.get("/download-csv")
@@ -224,54 +630,60 @@ def download_csv():
 @app.get("/data")
 def get_data(limit: int = 100):
     """Get historical sensor readings."""
-    with lock:
-        readings_list = list(sensor_readings)
-        data = readings_list[-limit:] if len(readings_list) > limit else readings_list
-    return {
-        "count": len(data),
-        "readings": data
-    }
+    data = recent_readings(limit)
+    # Readings only hold plain JSON values, so encode them directly
+    return Response(
+        content=json_dumps({"count": len(data), "readings": data}),
+        media_type="application/json"
+    )
 
 
 # -----------------------------
 # Control Endpoints
 # -----------------------------
+# Commands are encoded in the topic (e.g. aquaponics/control/pump/on) and
+# published with an empty payload, QoS 0 and no retain flag.
+PUMP_STATES = ("on", "off", "toggle")
+LIGHT_STATES = ("on", "off", "toggle", "auto")
+
+
 @app.post("/control/pump")
-def control_pump(state: str = "toggle"):
+def control_pump(state: str = "toggle") -> dict:
     """
     Control the pump. 
     state: 'on', 'off', or 'toggle'
     """
+    if state not in PUMP_STATES:
+        return {"success": False, "message": f"Invalid pump state: {state}"}
     if mqtt_client and mqtt_client.is_connected():
-        payload = json.dumps({"action": "pump", "state": state})
-        mqtt_client.publish("aquaponics/control/pump", payload)
+        mqtt_client.publish(f"aquaponics/control/pump/{state}", b"", qos=0)
         print(f"🔧 Sent pump control: {state}")
         return {"success": True, "message": f"Pump command sent: {state}"}
     return {"success": False, "message": "MQTT not connected"}
 
 
 @app.post("/control/light")
-def control_light(state: str = "toggle"):
+def control_light(state: str = "toggle") -> dict:
     """
     Control the grow light.
-    state: 'on', 'off', or 'toggle'
+    state: 'on', 'off', 'toggle', or 'auto'
     """
+    if state not in LIGHT_STATES:
+        return {"success": False, "message": f"Invalid light state: {state}"}
     if mqtt_client and mqtt_client.is_connected():
-        payload = json.dumps({"action": "light", "state": state})
-        mqtt_client.publish("aquaponics/control/light", payload)
+        mqtt_client.publish(f"aquaponics/control/light/{state}", b"", qos=0)
         print(f"💡 Sent light control: {state}")
         return {"success": True, "message": f"Light command sent: {state}"}
     return {"success": False, "message": "MQTT not connected"}
 
 
 @app.post("/control/simulate-failure")
-def simulate_failure(enable: bool = True):
+def simulate_failure(enable: bool = True) -> dict:
     """
     Trigger or stop a simulated pump failure for testing.
     """
     if mqtt_client and mqtt_client.is_connected():
-        payload = json.dumps({"action": "simulate_failure", "enable": enable})
-        mqtt_client.publish("aquaponics/control/simulate", payload)
+        mqtt_client.publish(f"aquaponics/control/simulate/{'on' if enable else 'off'}", b"", qos=0)
         status = "enabled" if enable else "disabled"
         print(f"⚠️ Pump failure simulation: {status}")
         return {"success": True, "message": f"Pump failure simulation {status}"}
@@ -279,12 +691,12 @@ def simulate_failure(enable: bool = True):
 
 
 @app.get("/status")
-def get_status():
+def get_status() -> dict:
     """Get system status."""
-    with lock:
-        reading_count = len(sensor_readings)
-        has_data = reading_count > 0
-        last_time = latest_reading.get("timestamp") if latest_reading else None
+    reading_count = min(_latest_idx + 1, MAX_READINGS)
+    has_data = reading_count > 0
+    snap = latest_reading
+    last_time = snap.get("timestamp") if snap else None
     
     return {
         "mqtt_broker": MQTT_BROKER,
@@ -292,50 +704,54 @@ def get_status():
         "mqtt_connected": mqtt_client.is_connected() if mqtt_client else False,
         "total_readings": reading_count,
         "has_data": has_data,
+        "csv_dropped": csv_dropped,
         "last_reading_time": last_time,
         "thresholds": THRESHOLDS
     }
 
 
 @app.get("/alerts")
-def get_alerts():
+def get_alerts() -> dict:
     """Get current alerts based on thresholds."""
-    with lock:
-        if not latest_reading:
-            return {"alerts": [], "message": "No data available"}
-        
-        alerts = []
-        r = latest_reading
-        
-        if r.get("dissolved_oxygen_mgL", 10) < THRESHOLDS["do_low"]:
-            alerts.append({"type": "warning", "sensor": "dissolved_oxygen", "message": f"Low DO: {r['dissolved_oxygen_mgL']} mg/L"})
-        if r.get("ammonia_mgL", 0) > THRESHOLDS["ammonia_high"]:
-            alerts.append({"type": "danger", "sensor": "ammonia", "message": f"High ammonia: {r['ammonia_mgL']} mg/L"})
-        if r.get("water_level_percent", 100) < THRESHOLDS["water_level_low"]:
-            alerts.append({"type": "danger", "sensor": "water_level", "message": f"Low water: {r['water_level_percent']}%"})
-        if r.get("water_temp_C", 20) > THRESHOLDS["temp_high"]:
-            alerts.append({"type": "warning", "sensor": "temperature", "message": f"High temp: {r['water_temp_C']}°C"})
-        if r.get("pH", 7) < THRESHOLDS["ph_low"]:
-            alerts.append({"type": "warning", "sensor": "pH", "message": f"Low pH: {r['pH']}"})
-        if r.get("pump_status") == "FAILURE":
-            alerts.append({"type": "danger", "sensor": "pump", "message": "Pump failure detected!"})
-        
-        return {
-            "alerts": alerts,
-            "alert_count": len(alerts),
-            "diagnosis": r.get("diagnosis", "Unknown")
-        }
-
-
-@app.get("/dashboard", response_class=HTMLResponse)
-def dashboard():
-    """Simple HTML dashboard for quick monitoring."""
-    return """
+    snap = latest_alerts
+    if not snap:
+        return {"alerts": [], "message": "No data available"}
+    return snap
+
+
+@app.get("/events")
+async def events():
+    """Stream each new reading and its alerts as Server-Sent Events."""
+    q = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+    _event_subscribers.add(q)
+
+    async def stream():
+        try:
+            while not _events_closed:
+                try:
+                    event = await asyncio.wait_for(q.get(), SSE_PING_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+                if event is None:  # server is shutting down
+                    break
+                yield event
+        finally:
+            _event_subscribers.discard(q)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
+
+
+# Dashboard page, encoded once at import
+_DASHBOARD_BYTES = """
     <!DOCTYPE html>
     <html>
     <head>
         <title>Aquaponics Dashboard</title>
-        <meta http-equiv="refresh" content="5">
         <style>
             body { font-family: Arial, sans-serif; padding: 20px; background: #1a1a2e; color: #eee; }
             h1 { color: #4ecca3; }
@@ -351,54 +767,75 @@ def dashboard():
         <h1>🌿 Aquaponics IoT Dashboard 🐟</h1>
         <div id="content">Loading...</div>
         <script>
-            async function update() {
+            function render(latest, alerts) {
+                if (latest.message) {
+                    document.getElementById('content').innerHTML = '<p>' + latest.message + '</p>';
+                    return;
+                }
+                
+                let html = '<div class="card ' + (alerts.alert_count === 0 ? 'ok' : '') + '">';
+                html += '<strong>Status:</strong> ' + (latest.diagnosis || 'Unknown') + '</div>';
+                
+                html += '<div class="grid">';
+                html += '<div class="card"><div class="label">Water Temp</div><div class="value">' + latest.water_temp_C + '°C</div></div>';
+                html += '<div class="card"><div class="label">Air Temp</div><div class="value">' + latest.air_temp_C + '°C</div></div>';
+                html += '<div class="card"><div class="label">pH</div><div class="value">' + latest.pH + '</div></div>';
+                html += '<div class="card"><div class="label">Dissolved O2</div><div class="value">' + latest.dissolved_oxygen_mgL + ' mg/L</div></div>';
+                html += '<div class="card"><div class="label">Ammonia</div><div class="value">' + latest.ammonia_mgL + ' mg/L</div></div>';
+                html += '<div class="card"><div class="label">Water Level</div><div class="value">' + latest.water_level_percent + '%</div></div>';
+                html += '<div class="card"><div class="label">EC</div><div class="value">' + latest.ec_uScm + ' µS/cm</div></div>';
+                html += '<div class="card"><div class="label">Humidity</div><div class="value">' + latest.humidity_percent + '%</div></div>';
+                html += '<div class="card"><div class="label">Light</div><div class="value">' + latest.light_lux + ' lux</div></div>';
+                html += '<div class="card"><div class="label">Pump</div><div class="value">' + latest.pump_status + '</div></div>';
+                html += '</div>';
+                
+                if (alerts.alerts && alerts.alerts.length > 0) {
+                    html += '<h2>⚠️ Alerts</h2>';
+                    alerts.alerts.forEach(a => {
+                        html += '<div class="alert">' + a.message + '</div>';
+                    });
+                }
+                
+                html += '<p style="color:#666;margin-top:20px;">Last update: ' + latest.timestamp + '</p>';
+                
+                document.getElementById('content').innerHTML = html;
+            }
+            
+            async function load() {
                 try {
                     const latest = await fetch('/latest').then(r => r.json());
                     const alerts = await fetch('/alerts').then(r => r.json());
-                    
-                    if (latest.message) {
-                        document.getElementById('content').innerHTML = '<p>' + latest.message + '</p>';
-                        return;
-                    }
-                    
-                    let html = '<div class="card ' + (alerts.alert_count === 0 ? 'ok' : '') + '">';
-                    html += '<strong>Status:</strong> ' + (latest.diagnosis || 'Unknown') + '</div>';
-                    
-                    html += '<div class="grid">';
-                    html += '<div class="card"><div class="label">Water Temp</div><div class="value">' + latest.water_temp_C + '°C</div></div>';
-                    html += '<div class="card"><div class="label">Air Temp</div><div class="value">' + latest.air_temp_C + '°C</div></div>';
-                    html += '<div class="card"><div class="label">pH</div><div class="value">' + latest.pH + '</div></div>';
-                    html += '<div class="card"><div class="label">Dissolved O2</div><div class="value">' + latest.dissolved_oxygen_mgL + ' mg/L</div></div>';
-                    html += '<div class="card"><div class="label">Ammonia</div><div class="value">' + latest.ammonia_mgL + ' mg/L</div></div>';
-                    html += '<div class="card"><div class="label">Water Level</div><div class="value">' + latest.water_level_percent + '%</div></div>';
-                    html += '<div class="card"><div class="label">EC</div><div class="value">' + latest.ec_uScm + ' µS/cm</div></div>';
-                    html += '<div class="card"><div class="label">Humidity</div><div class="value">' + latest.humidity_percent + '%</div></div>';
-                    html += '<div class="card"><div class="label">Light</div><div class="value">' + latest.light_lux + ' lux</div></div>';
-                    html += '<div class="card"><div class="label">Pump</div><div class="value">' + latest.pump_status + '</div></div>';
-                    html += '</div>';
-                    
-                    if (alerts.alerts && alerts.alerts.length > 0) {
-                        html += '<h2>⚠️ Alerts</h2>';
-                        alerts.alerts.forEach(a => {
-                            html += '<div class="alert">' + a.message + '</div>';
-                        });
-                    }
-                    
-                    html += '<p style="color:#666;margin-top:20px;">Last update: ' + latest.timestamp + '</p>';
-                    
-                    document.getElementById('content').innerHTML = html;
+                    render(latest, alerts);
                 } catch(e) {
                     document.getElementById('content').innerHTML = '<p>Error loading data: ' + e + '</p>';
                 }
             }
-            update();
+            
+            // Initial state, then live updates pushed by the server
+            load();
+            const source = new EventSource('/events');
+            source.onmessage = e => {
+                const d = JSON.parse(e.data);
+                render(d.latest, d.alerts);
+            };
         </script>
     </body>
     </html>
-    """
+    """.encode("utf-8")
+
+
+@app.get("/dashboard", response_class=HTMLResponse)
+def dashboard():
+    """Simple HTML dashboard for quick monitoring."""
+    return Response(
+        content=_DASHBOARD_BYTES,
+        media_type="text/html",
+        headers={"Cache-Control": "public, max-age=300"}
+    )
 
 
 if __name__ == "__main__":
     import uvicorn
     print("\n🚀 Starting Aquaponics IoT API Server...")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(app, host="0.0.0.0", port=8000, access_log=False,
+                timeout_graceful_shutdown=5)
@@ -14,8 +14,9 @@ import json
 import time
 import random
 import math
+import sys
 import argparse
-from datetime import datetime
+from datetime import datetime, timedelta
 
 try:
     import paho.mqtt.client as mqtt
@@ -23,12 +24,32 @@ except ImportError:
     print("Please install paho-mqtt: pip3 install paho-mqtt")
     exit(1)
 
+# orjson is optional; publish() accepts either output
+try:
+    import orjson
+    json_dumps = orjson.dumps
+except ImportError:
+    json_dumps = json.dumps
+
+# msgpack is optional; combined readings fall back to JSON without it
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# numpy is only needed for batched generation (--batch)
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 # -----------------------------
 # Configuration
 # -----------------------------
 MQTT_PORT = 1883
 PUBLISH_INTERVAL = 5  # seconds between readings
+QUIET_SUMMARY_EVERY = 100  # readings between one-line summaries with --quiet
 
 # MQTT Topics
 TOPICS = {
@@ -44,12 +65,43 @@ TOPICS = {
     "all_sensors": "aquaponics/sensors/all"  # Combined reading
 }
 
-# Control Topics
-CONTROL_TOPICS = [
-    "aquaponics/control/pump",
-    "aquaponics/control/light",
-    "aquaponics/control/simulate"
-]
+# Reading key published on each per-sensor topic (only with --granular)
+SENSOR_KEY_MAP = {
+    "water_temp": "water_temp_C",
+    "air_temp": "air_temp_C",
+    "ph": "pH",
+    "ammonia": "ammonia_mgL",
+    "dissolved_oxygen": "dissolved_oxygen_mgL",
+    "ec": "ec_uScm",
+    "water_level": "water_level_percent",
+    "humidity": "humidity_percent",
+    "light": "light_lux"
+}
+
+# MessagePack readings are sent as [version, *values] in this field order.
+# Keep in sync with READING_FIELDS in api_server.py; bump the version on change.
+READING_FORMAT_VERSION = 1
+READING_FIELDS = (
+    "timestamp", "water_temp_C", "air_temp_C", "pH", "ammonia_mgL",
+    "dissolved_oxygen_mgL", "ec_uScm", "water_level_percent",
+    "humidity_percent", "light_lux", "pump_status", "light_status", "reading_id"
+)
+
+
+def pack_reading(readings):
+    """Encode a combined reading for aquaponics/sensors/all."""
+    if msgpack is None:
+        return json_dumps(readings)
+    return msgpack.packb([READING_FORMAT_VERSION] + [readings[f] for f in READING_FIELDS])
+
+
+# Control Topics - the command is the last topic level, payload is empty
+# (e.g. aquaponics/control/pump/toggle, aquaponics/control/simulate/on)
+CONTROL_TOPICS = {
+    "pump": "aquaponics/control/pump/+",
+    "light": "aquaponics/control/light/+",
+    "simulate": "aquaponics/control/simulate/+"
+}
 
 
 class AquaponicsSensorSimulator:
@@ -69,13 +121,10 @@ class AquaponicsSensorSimulator:
         self.pump_failure = False    # Simulated failure state
         self.manual_light = False    # Manual light control mode
         
-    def get_hour_of_day(self):
-        """Get current hour (0-23) for day/night cycles."""
-        return datetime.now().hour
-    
-    def daily_cycle(self, mean, amplitude, noise_std):
-        """Generate value with daily sinusoidal pattern."""
-        hour = self.get_hour_of_day()
+        self.rng = np.random.default_rng() if np is not None else None
+        
+    def daily_cycle(self, mean, amplitude, noise_std, hour):
+        """Generate value with daily sinusoidal pattern for the given hour (0-23)."""
         value = mean + amplitude * math.sin(2 * math.pi * hour / 24)
         value += random.gauss(0, noise_std)
         return round(value, 2)
@@ -111,23 +160,24 @@ class AquaponicsSensorSimulator:
     def get_readings(self):
         """Generate a complete set of sensor readings."""
         self.reading_count += 1
+        now = datetime.now()
+        hour = now.hour
         
         # Slow drifts over time
         self.ph_drift -= 0.0001  # pH slowly decreases
         self.ec_drift += random.gauss(0, 0.5)  # EC drifts randomly
         
         # Base readings with daily cycles
-        water_temp = self.daily_cycle(23.5, 1.5, 0.2)
-        air_temp = self.daily_cycle(22.0, 2.0, 0.3)
+        water_temp = self.daily_cycle(23.5, 1.5, 0.2, hour)
+        air_temp = self.daily_cycle(22.0, 2.0, 0.3, hour)
         ph = round(6.9 + self.ph_drift + random.gauss(0, 0.05), 2)
         ammonia = round(max(0, random.gauss(0.15, 0.05)), 3)
-        dissolved_oxygen = self.daily_cycle(6.5, 0.6, 0.15)
+        dissolved_oxygen = self.daily_cycle(6.5, 0.6, 0.15, hour)
         ec = round(900 + self.ec_drift, 1)
         water_level = round(95 + random.gauss(0, 2), 1)
-        humidity = self.daily_cycle(60, 10, 2)
+        humidity = self.daily_cycle(60, 10, 2, hour)
         
         # Light - auto mode follows day/night, manual mode uses light_on state
-        hour = self.get_hour_of_day()
         if self.manual_light:
             light = 20000 if self.light_on else 0
         else:
@@ -147,7 +197,7 @@ class AquaponicsSensorSimulator:
             pump_status = "ON"
         
         return {
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": now.isoformat(),
             "water_temp_C": water_temp,
             "air_temp_C": air_temp,
             "pH": ph,
@@ -162,6 +212,92 @@ class AquaponicsSensorSimulator:
             "reading_id": self.reading_count
         }
 
+    
+    def get_readings_batch(self, k, spacing=0):
+        """Generate k sets of sensor readings in one vectorized pass (needs numpy).
+
+        Timestamps are spaced `spacing` seconds apart, starting now.
+        """
+        ids = range(self.reading_count + 1, self.reading_count + k + 1)
+        self.reading_count += k
+        noise = self.rng.standard_normal((k, 9))
+        
+        # Slow drifts over time, continued reading by reading
+        ph_drift = self.ph_drift - 0.0001 * np.arange(1, k + 1)
+        ec_drift = self.ec_drift + np.cumsum(noise[:, 0] * 0.5)
+        self.ph_drift = float(ph_drift[-1])
+        self.ec_drift = float(ec_drift[-1])
+        
+        # Base readings with daily cycles
+        now = datetime.now()
+        hour = now.hour
+        cycle = math.sin(2 * math.pi * hour / 24)
+        water_temp = np.round(23.5 + 1.5 * cycle + 0.2 * noise[:, 1], 2)
+        air_temp = np.round(22.0 + 2.0 * cycle + 0.3 * noise[:, 2], 2)
+        ph = np.round(6.9 + ph_drift + 0.05 * noise[:, 3], 2)
+        ammonia = np.round(np.maximum(0, 0.15 + 0.05 * noise[:, 4]), 3)
+        dissolved_oxygen = np.round(6.5 + 0.6 * cycle + 0.15 * noise[:, 5], 2)
+        ec = np.round(900 + ec_drift, 1)
+        water_level = np.round(95 + 2 * noise[:, 6], 1)
+        humidity = np.round(60 + 10 * cycle + 2 * noise[:, 7], 2)
+        
+        # Light - auto mode follows day/night, manual mode uses light_on state
+        if self.manual_light:
+            light = 20000 if self.light_on else 0
+        else:
+            light = max(0, 20000 * math.sin(2 * math.pi * (hour - 6) / 24))
+        light = np.round(light + 500 * noise[:, 8], 0)
+        if self.manual_light:
+            light_status = ["ON" if self.light_on else "OFF"] * k
+        else:
+            light_status = np.where(light > 0, "ON", "OFF").tolist()
+        
+        # Determine pump status
+        if self.pump_failure:
+            pump_status = "FAILURE"
+            water_level -= 20
+            dissolved_oxygen -= 2
+        elif not self.pump_on:
+            pump_status = "OFF"
+            water_level -= 5
+            dissolved_oxygen -= 1
+        else:
+            pump_status = "ON"
+        
+        timestamps = [(now + timedelta(seconds=i * spacing)).isoformat() for i in range(k)]
+        columns = zip(
+            timestamps,
+            water_temp.tolist(),
+            air_temp.tolist(),
+            ph.tolist(),
+            ammonia.tolist(),
+            np.round(np.maximum(0, dissolved_oxygen), 2).tolist(),
+            ec.tolist(),
+            np.round(np.maximum(0, water_level), 1).tolist(),
+            np.round(humidity, 1).tolist(),
+            np.maximum(0, light).tolist(),
+            light_status,
+            ids,
+        )
+        return [
+            {
+                "timestamp": ts,
+                "water_temp_C": wt,
+                "air_temp_C": at,
+                "pH": p,
+                "ammonia_mgL": nh3,
+                "dissolved_oxygen_mgL": do,
+                "ec_uScm": e,
+                "water_level_percent": wl,
+                "humidity_percent": h,
+                "light_lux": lx,
+                "pump_status": pump_status,
+                "light_status": ls,
+                "reading_id": rid
+            }
+            for ts, wt, at, p, nh3, do, e, wl, h, lx, ls, rid in columns
+        ]
+
 
 # Global simulator instance for control commands
 simulator = None
@@ -172,45 +308,75 @@ def on_connect(client, userdata, flags, rc):
     if rc == 0:
         print("✅ Connected to MQTT Broker!")
         # Subscribe to control topics
-        for topic in CONTROL_TOPICS:
+        for topic in CONTROL_TOPICS.values():
             client.subscribe(topic)
             print(f"📡 Subscribed to: {topic}")
     else:
         print(f"❌ Connection failed with code {rc}")
 
 
-def on_message(client, userdata, msg):
-    """Handle incoming control messages."""
-    global simulator
+def command_state(msg):
+    """Log a control message and return its command (the last topic level)."""
+    print(f"\n📥 Received control command: {msg.topic}")
+    return msg.topic.rsplit("/", 1)[-1]
+
+
+def on_pump(client, userdata, msg):
+    """Handle aquaponics/control/pump/<state>."""
     try:
-        payload = json.loads(msg.payload.decode())
-        print(f"\n📥 Received control command: {msg.topic}")
-        
-        if msg.topic == "aquaponics/control/pump":
-            state = payload.get("state", "toggle")
-            simulator.set_pump(state)
-            
-        elif msg.topic == "aquaponics/control/light":
-            state = payload.get("state", "toggle")
-            simulator.set_light(state)
-            
-        elif msg.topic == "aquaponics/control/simulate":
-            enable = payload.get("enable", True)
-            simulator.set_failure_simulation(enable)
-            
+        simulator.set_pump(command_state(msg))
     except Exception as e:
         print(f"❌ Error processing control message: {e}")
 
 
+def on_light(client, userdata, msg):
+    """Handle aquaponics/control/light/<state>."""
+    try:
+        simulator.set_light(command_state(msg))
+    except Exception as e:
+        print(f"❌ Error processing control message: {e}")
+
+
+def on_simulate(client, userdata, msg):
+    """Handle aquaponics/control/simulate/<on|off>."""
+    try:
+        simulator.set_failure_simulation(command_state(msg) == "on")
+    except Exception as e:
+        print(f"❌ Error processing control message: {e}")
+
+
+def format_reading(readings):
+    """Format a reading as the multi-line console block."""
+    return (
+        f"[{readings['timestamp']}] Reading #{readings['reading_id']}\n"
+        f"  🌡️  Water: {readings['water_temp_C']}°C | Air: {readings['air_temp_C']}°C\n"
+        f"  💧 pH: {readings['pH']} | DO: {readings['dissolved_oxygen_mgL']} mg/L\n"
+        f"  ⚗️  NH3: {readings['ammonia_mgL']} mg/L | EC: {readings['ec_uScm']} µS/cm\n"
+        f"  📊 Water Level: {readings['water_level_percent']}% | Humidity: {readings['humidity_percent']}%\n"
+        f"  💡 Light: {readings['light_lux']} lux ({readings['light_status']}) | Pump: {readings['pump_status']}\n"
+        + "-" * 60 + "\n"
+    )
+
+
 def main():
     global simulator
     
     parser = argparse.ArgumentParser(description="Aquaponics Sensor Simulator")
     parser.add_argument("--broker", required=True, help="MQTT Broker IP address")
     parser.add_argument("--port", type=int, default=1883, help="MQTT Broker port")
-    parser.add_argument("--interval", type=int, default=5, help="Seconds between readings")
+    parser.add_argument("--interval", type=float, default=5, help="Seconds between readings")
+    parser.add_argument("--batch", type=int, default=1,
+                        help="Readings generated per interval (needs numpy when > 1)")
+    parser.add_argument("--granular", action="store_true",
+                        help="Also publish each sensor on its own topic")
+    parser.add_argument("--quiet", action="store_true",
+                        help=f"Only print a summary every {QUIET_SUMMARY_EVERY} readings")
     args = parser.parse_args()
     
+    if args.batch > 1 and np is None:
+        print("Please install numpy for --batch: pip3 install numpy")
+        exit(1)
+    
     print(f"""
 ╔═══════════════════════════════════════════════════════╗
 ║     🌿 Aquaponics IoT Sensor Simulator 🐟             ║
@@ -225,7 +391,9 @@ def main():
     # Create MQTT client
     client = mqtt.Client(client_id="rpi_sensor_simulator")
     client.on_connect = on_connect
-    client.on_message = on_message
+    client.message_callback_add(CONTROL_TOPICS["pump"], on_pump)
+    client.message_callback_add(CONTROL_TOPICS["light"], on_light)
+    client.message_callback_add(CONTROL_TOPICS["simulate"], on_simulate)
     
     try:
         print(f"🔌 Connecting to broker at {args.broker}:{args.port}...")
@@ -238,49 +406,30 @@ def main():
         print("🎮 Listening for control commands...\n")
         
         while True:
-            readings = simulator.get_readings()
-            
-            # Publish individual sensor readings
-            for sensor, topic in TOPICS.items():
-                if sensor == "all_sensors":
-                    continue
-                if sensor == "water_temp":
-                    value = readings["water_temp_C"]
-                elif sensor == "air_temp":
-                    value = readings["air_temp_C"]
-                elif sensor == "ph":
-                    value = readings["pH"]
-                elif sensor == "ammonia":
-                    value = readings["ammonia_mgL"]
-                elif sensor == "dissolved_oxygen":
-                    value = readings["dissolved_oxygen_mgL"]
-                elif sensor == "ec":
-                    value = readings["ec_uScm"]
-                elif sensor == "water_level":
-                    value = readings["water_level_percent"]
-                elif sensor == "humidity":
-                    value = readings["humidity_percent"]
-                elif sensor == "light":
-                    value = readings["light_lux"]
-                else:
-                    continue
-                    
-                client.publish(topic, json.dumps({"value": value, "timestamp": readings["timestamp"]}))
-            
-            # Publish combined reading
-            payload = json.dumps(readings)
-            client.publish(TOPICS["all_sensors"], payload)
-            
-            # Pretty print
-            print(f"[{readings['timestamp']}] Reading #{readings['reading_id']}")
-            print(f"  🌡️  Water: {readings['water_temp_C']}°C | Air: {readings['air_temp_C']}°C")
-            print(f"  💧 pH: {readings['pH']} | DO: {readings['dissolved_oxygen_mgL']} mg/L")
-            print(f"  ⚗️  NH3: {readings['ammonia_mgL']} mg/L | EC: {readings['ec_uScm']} µS/cm")
-            print(f"  📊 Water Level: {readings['water_level_percent']}% | Humidity: {readings['humidity_percent']}%")
-            print(f"  💡 Light: {readings['light_lux']} lux ({readings['light_status']}) | Pump: {readings['pump_status']}")
-            print("-" * 60)
+            if args.batch > 1:
+                batch = simulator.get_readings_batch(args.batch, args.interval / args.batch)
+            else:
+                batch = [simulator.get_readings()]
             
-            time.sleep(args.interval)
+            for readings in batch:
+                # Encode every message first, then publish them back to back:
+                # individual sensor readings (--granular) and the combined reading
+                msgs = []
+                if args.granular:
+                    ts = readings["timestamp"]
+                    msgs = [(TOPICS[sensor], json_dumps({"value": readings[key], "timestamp": ts}))
+                            for sensor, key in SENSOR_KEY_MAP.items()]
+                msgs.append((TOPICS["all_sensors"], pack_reading(readings)))
+                for topic, payload in msgs:
+                    client.publish(topic, payload)
+                
+                # Pretty print (one write per reading), or a periodic summary when quiet
+                if not args.quiet:
+                    sys.stdout.write(format_reading(readings))
+                elif readings["reading_id"] % QUIET_SUMMARY_EVERY == 0:
+                    sys.stdout.write(f"[{readings['timestamp']}] {readings['reading_id']} readings published\n")
+                
+                time.sleep(args.interval / len(batch))
             
     except KeyboardInterrupt:
         print("\n\n🛑 Stopping sensor simulation...")